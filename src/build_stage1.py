@@ -1,10 +1,9 @@
 
 import argparse
 import sys
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession
 from pyspark.sql import functions as F
-from pyspark.sql.window import Window
-from pyspark.sql.types import StructType, LongType
 
 def main():
     parser = argparse.ArgumentParser(description="Stage 1 Dataset Curation for Early Product Success Prediction")
@@ -18,8 +17,11 @@ def main():
         .appName("Stage1_Curation") \
         .master("local[*]") \
         .config("spark.driver.memory", "4g") \
-        .config("spark.sql.shuffle.partitions", "8") \
-        .config("spark.sql.parquet.enableVectorizedReader", "false") \
+        .config("spark.sql.adaptive.enabled", "true") \
+        .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
+        .config("spark.sql.adaptive.skewJoin.enabled", "true") \
+        .config("spark.sql.adaptive.advisoryPartitionSizeInBytes", "64m") \
+        .config("spark.sql.adaptive.autoBroadcastJoinThreshold", "50m") \
         .config("spark.sql.parquet.int96RebaseModeInRead", "CORRECTED") \
         .config("spark.sql.parquet.int96RebaseModeInWrite", "CORRECTED") \
         .config("spark.sql.parquet.datetimeRebaseModeInRead", "CORRECTED") \
@@ -38,17 +40,7 @@ def main():
     print("Stage 1: Loading Data...")
     # Read parquet files. Schema is inferred but we expect certain columns based on requirements.
     try:
-        # Hack: Force 'timestamp' to be read as LongType (it contains ms epoch)
-        # Spark infers it as TimestampNTZ but values are large integers (ms), causing overflow/weird dates if interpreted directly.
-        raw_schema = spark.read.option("mergeSchema", "true").parquet(args.reviews).schema
-        new_fields = []
-        for field in raw_schema.fields:
-            if field.name == "timestamp":
-                field.dataType = LongType()
-            new_fields.append(field)
-        final_schema = StructType(new_fields)
-        
-        df_reviews_raw = spark.read.schema(final_schema).parquet(args.reviews)
+        df_reviews_raw = spark.read.parquet(args.reviews)
         df_meta_raw = spark.read.parquet(args.meta)
     except Exception as e:
         print(f"Error loading data: {e}")
@@ -60,23 +52,24 @@ def main():
     print("Stage 2: Calculating Time Anchor & Launch Date...")
     # Modeling Grain: parent_asin
     
-    # Convert timestamp (ms) to review_date (timestamp type)
-    # We use cast("timestamp") which assumes the input is in seconds if using from_unixtime, 
-    # but input is ms, so divide by 1000.
-    # timestamp is treated as LongType now, so we can divide.
-    
+    # Convert timestamp (epoch ns) to review_date (timestamp type).
+    # Cast to long in the projection instead of doctoring the read schema:
+    # the vectorized reader decodes the column natively and we avoid an
+    # extra footer scan just to rewrite the schema.
+
     df_reviews = df_reviews_raw.withColumn(
-        "review_date", F.from_unixtime(F.col("timestamp") / 1_000_000_000).cast("timestamp")
+        "review_date", F.from_unixtime(F.col("timestamp").cast("long") / F.lit(1_000_000_000)).cast("timestamp")
     )
     
-    # Compute launch_date per parent_asin as min(review_date)
-    window_parent = Window.partitionBy("parent_asin")
-    
-    # We join launch_date back or use window function directly. 
-    # For efficiency with large data, window function is fine if we persist or careful.
-    # Let's add it as a column to the reviews.
-    df_reviews = df_reviews.withColumn("launch_date", F.min("review_date").over(window_parent))
-    
+    # Compute launch_date per parent_asin as min(review_date).
+    # A window over parent_asin would shuffle+sort the full reviews dataset
+    # just to attach a per-product minimum; a small groupBy result
+    # broadcast-joined back achieves the same without that stage.
+    df_launch = df_reviews.select("parent_asin", "review_date").groupBy("parent_asin").agg(
+        F.min("review_date").alias("launch_date")
+    )
+    df_reviews = df_reviews.join(F.broadcast(df_launch), on="parent_asin", how="inner")
+
     # Compute day_from_launch
     df_reviews = df_reviews.withColumn(
         "day_from_launch", 
@@ -91,64 +84,53 @@ def main():
     # eligible: reviews_28d >= 3
     # Rationale: early data is sparse, need sufficient signal.
     
-    # We aggregate at parent_asin level to creating the product_index
-    # First, flag reviews that fall in the window
-    df_reviews = df_reviews.withColumn(
-        "is_day_0_27", 
-        F.when((F.col("day_from_launch") >= 0) & (F.col("day_from_launch") <= 27), 1).otherwise(0)
-    )
-    
+    # We aggregate at parent_asin level to creating the product_index.
+    # The window counts are computed as conditional counts directly in the
+    # aggregation below, so no per-row flag columns are materialized.
+
     # -------------------------------------------------------------------------
     # 4. Observability (Avoid Right-Censoring)
     # -------------------------------------------------------------------------
     print("Stage 4: Checking Observability...")
-    # global dataset end date
-    dataset_end = df_reviews.agg(F.max("review_date")).collect()[0][0]
-    print(f"Dataset End Date: {dataset_end}")
-    
-    # We will compute product level stats now
-    df_product_stats = df_reviews.groupBy("parent_asin").agg(
-        F.min("launch_date").alias("launch_date"),
-        F.sum("is_day_0_27").alias("reviews_28d")
-    )
-    
-    # Add Observability
-    # Dataset End - 55 days
-    cutoff_date = F.date_sub(F.lit(dataset_end), 55)
-    
-    df_product_stats = df_product_stats.withColumn(
-        "observable_55d",
-        F.col("launch_date") <= cutoff_date
-    )
-    
-    # Add Eligibility
-    df_product_stats = df_product_stats.withColumn(
-        "eligible",
-        F.col("reviews_28d") >= 3
-    )
-    
+    # The global dataset end date is derived from the product aggregation
+    # below (max of the per-group max) instead of a dedicated full scan.
+
     # -------------------------------------------------------------------------
     # 5. Future Traction Flags
     # -------------------------------------------------------------------------
     print("Stage 5: Calculating Future Traction Flags...")
     # future_reviews_28d: count where 28 <= day_from_launch <= 55
     # Only meaningful for observable products, but we compute raw count first.
-    
-    df_reviews = df_reviews.withColumn(
-        "is_future_28_55",
-        F.when((F.col("day_from_launch") >= 28) & (F.col("day_from_launch") <= 55), 1).otherwise(0)
-    )
-    
-    # We need to aggregate this back to product level. 
-    # Since we already grouped, let's do a separate group and join, or do it all in one pass.
-    # One pass aggregation is better. Re-doing aggregation with both metrics.
-    
-    df_product_agg = df_reviews.groupBy("parent_asin").agg(
-        F.min("launch_date").alias("launch_date"),
-        F.sum("is_day_0_27").alias("reviews_28d"),
-        F.sum("is_future_28_55").alias("future_reviews_28d")
+
+    # Persist the fully derived reviews DF: the aggregation, the filter join
+    # and the final write are separate actions, and without this each one
+    # re-reads the parquet and re-runs the whole withColumn chain.
+    df_reviews = df_reviews.persist(StorageLevel.MEMORY_AND_DISK)
+    df_reviews.count()
+
+    # Aggregate everything to product level in a single pass: both review
+    # counters plus launch_date, so the reviews dataset is shuffled once.
+
+    # Project down to just the aggregation inputs before the shuffle so the
+    # wide columns (text, title, ...) are never shipped between stages; the
+    # full df_reviews is only needed again for the filtered output.
+    df_reviews_agg = df_reviews.select("parent_asin", "review_date", "day_from_launch")
+
+    df_product_agg = df_reviews_agg.groupBy("parent_asin").agg(
+        F.min("review_date").alias("launch_date"),
+        F.count(F.when(F.col("day_from_launch").between(0, 27), True)).alias("reviews_28d"),
+        F.count(F.when(F.col("day_from_launch").between(28, 55), True)).alias("future_reviews_28d"),
+        F.max("review_date").alias("max_review_date")
     )
-    
+
+    # global dataset end date, read off the small aggregated result
+    dataset_end = df_product_agg.agg(F.max("max_review_date")).collect()[0][0]
+    print(f"Dataset End Date: {dataset_end}")
+    df_product_agg = df_product_agg.drop("max_review_date")
+
+    # Dataset End - 55 days
+    cutoff_date = F.date_sub(F.lit(dataset_end), 55)
+
     # Re-apply observability/eligibility logic on this aggregated DF
     df_product_index = df_product_agg.withColumn(
         "dataset_end", F.lit(dataset_end)
@@ -186,18 +168,30 @@ def main():
     # -------------------------------------------------------------------------
     print("Stage 6: Applying Final Keep Rule & Filtering...")
     # keep_product = eligible AND observable_55d
-    df_product_index = df_product_index.withColumn(
-        "keep_product",
-        F.col("eligible") & F.col("observable_55d")
+    # launch_year added for convenience. Both in one select so they fuse
+    # into a single projection over the index instead of chained nodes.
+    df_product_index = df_product_index.select(
+        "*",
+        (F.col("eligible") & F.col("observable_55d")).alias("keep_product"),
+        F.year("launch_date").alias("launch_year")
     )
-    
-    # Add launch_year for convenience
-    df_product_index = df_product_index.withColumn("launch_year", F.year("launch_date"))
 
-    # Filtered Product List (small enough to broadcast if needed, but let's join normally)
+    # Persist the finished index before anything fans out from it: the
+    # kept-products list, the QC counters, the summary and the final write
+    # should all reuse one materialization rather than re-running the
+    # aggregation chain. It is small, so memory-only is fine.
+    df_product_index = df_product_index.persist(StorageLevel.MEMORY_ONLY)
+    df_product_index.count()
+
+    # Filtered Product List: a small parent_asin list (MBs at most for
+    # All_Beauty), so broadcast it and get hash joins instead of shuffling
+    # the reviews/meta datasets for a sort-merge join. parent_asin is the
+    # group-by key of the index, so it is already unique — no distinct.
     # We need to filter the main reviews dataset.
-    
-    df_kept_products = df_product_index.filter(F.col("keep_product") == True).select("parent_asin").distinct()
+
+    df_kept_products = F.broadcast(
+        df_product_index.filter(F.col("keep_product") == True).select("parent_asin")
+    )
     
     # Filter Reviews
     # join with keeping rows
@@ -222,19 +216,16 @@ def main():
     # -------------------------------------------------------------------------
     print("Stage 7: processing Metadata...")
     # meta_clean_filtered
-    # Filter to kept products
-    df_meta_filtered = df_meta_raw.join(df_kept_products, on="parent_asin", how="inner")
-    
     # Drop media URL fields
-    # Dropping bought_together: EDA showed 100% null coverage in All_Beauty metadata, 
+    # Dropping bought_together: EDA showed 100% null coverage in All_Beauty metadata,
     # so it adds no signal and only increases storage/processing cost.
-    cols_to_drop = ["images", "videos", "bought_together"]
-    df_meta_cleaned = df_meta_filtered.drop(*cols_to_drop)
-    
-    # Dropping categories: EDA found it is empty or not consistently populated for this subset, 
+    # Dropping categories: EDA found it is empty or not consistently populated for this subset,
     # so it does not provide reliable enrichment for product-level modeling.
-    cols_to_drop = ["categories"]
-    df_meta_cleaned = df_meta_cleaned.drop(*cols_to_drop)
+    # Drop BEFORE the join so the heavy struct/array columns are never read
+    # from parquet or shipped through the join.
+    cols_to_drop = ["images", "videos", "bought_together", "categories"]
+    df_meta_cleaned = df_meta_raw.drop(*cols_to_drop) \
+        .join(df_kept_products, on="parent_asin", how="inner")
 
     # Note: We avoid generic "scan all columns to find 100% null" checks in Spark because it triggers
     # full-data actions (extra passes over parquet). Instead, we drop known low-value fields identified in EDA.
@@ -244,12 +235,17 @@ def main():
     # 8. QC & Observability Output
     # -------------------------------------------------------------------------
     print("Stage 8: Running Quality Checks...")
-    # Caching product index for counts
-    df_product_index.cache()
-    
-    total_parents = df_product_index.count()
-    kept_parents = df_product_index.filter(F.col("keep_product") == True).count()
-    
+
+    # One aggregation returning all three QC scalars in a single Row,
+    # instead of three separate actions (each a full pass even when cached).
+    qc_stats = df_product_index.agg(
+        F.count("*").alias("total"),
+        F.sum(F.when(F.col("keep_product"), 1).otherwise(0)).alias("kept"),
+        (F.count("*") - F.countDistinct("parent_asin")).alias("dup")
+    ).collect()[0]
+    total_parents = qc_stats["total"]
+    kept_parents = qc_stats["kept"] or 0
+
     print("\n" + "="*40)
     print("QUALITY CHECKS")
     print("="*40)
@@ -259,10 +255,9 @@ def main():
         print(f"% Kept: {kept_parents/total_parents*100:.2f}%")
     else:
         print("% Kept: 0.00%")
-        
+
     # Check duplicates
-    dup_check = df_product_index.groupBy("parent_asin").count().filter("count > 1").count()
-    print(f"Duplicate parent_asin in index: {dup_check}")
+    print(f"Duplicate parent_asin in index: {qc_stats['dup']}")
     
     # Check integrity
     # confirm every parent_asin in reviews_filtered exists in product_index with keep_product=True
@@ -271,9 +266,15 @@ def main():
 
     # Distribution Summary
     # reviews_28d and future_reviews_28d
+    # approxQuantile computes all requested quantiles for both columns in a
+    # single pass (Greenwald-Khanna), cheaper than the summary() SQL path.
     print("\nDistribution Summary (Kept Products Only):")
     df_kept_stats = df_product_index.filter(F.col("keep_product") == True)
-    df_kept_stats.select("reviews_28d", "future_reviews_28d").summary("min", "50%", "95%").show()
+    qs = df_kept_stats.stat.approxQuantile(
+        ["reviews_28d", "future_reviews_28d"], [0.0, 0.5, 0.95], 0.01
+    )
+    print(f"reviews_28d min/p50/p95: {qs[0]}")
+    print(f"future_reviews_28d min/p50/p95: {qs[1]}")
 
     # -------------------------------------------------------------------------
     # 9. Writing Output
@@ -282,10 +283,22 @@ def main():
     print("Writing outputs...")
     
     # reviews_filtered
+    # No coalesce(1) on the large outputs: it funnels the whole write
+    # through a single task. product_index stays a single file since it
+    # is small and nicer to hand around as one part.
+    # Cluster by parent_asin so each row group covers a narrow key range:
+    # stage-2 filters/joins on parent_asin can then prune row groups via the
+    # parquet min/max stats, and the repeated key compresses better.
     out_reviews = f"{args.out}/reviews_filtered.parquet"
-    df_reviews_filtered.coalesce(1).write.mode("overwrite").option("compression", "snappy").parquet(out_reviews)
+    df_reviews_filtered.repartition(8, "parent_asin") \
+        .sortWithinPartitions("parent_asin") \
+        .write.mode("overwrite") \
+        .option("compression", "snappy") \
+        .option("parquet.block.size", 128 * 1024 * 1024) \
+        .parquet(out_reviews)
     print(f"Wrote {out_reviews}")
-    
+    df_reviews.unpersist()
+
     # product_index
     out_index = f"{args.out}/product_index.parquet"
     df_product_index.coalesce(1).write.mode("overwrite").option("compression", "snappy").parquet(out_index)
@@ -293,9 +306,11 @@ def main():
     
     # meta_clean_filtered
     out_meta = f"{args.out}/meta_clean_filtered.parquet"
-    df_meta_cleaned.coalesce(1).write.mode("overwrite").option("compression", "snappy").parquet(out_meta)
+    df_meta_cleaned.write.mode("overwrite").option("compression", "snappy").parquet(out_meta)
     print(f"Wrote {out_meta}")
-    
+
+    df_product_index.unpersist(blocking=False)
+
     spark.stop()
 
 if __name__ == "__main__":
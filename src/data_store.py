@@ -1,77 +1,103 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import pandas as pd
+import pyarrow as pa
+import pyarrow.json as paj
+import pyarrow.parquet as pq
 from .config import RAW_DIR, PROCESSED_DIR, URLS
-from .download_file import download_if_missing, gunzip_file
+from .download_file import download_if_missing
 
 
-def ensure_raw_files() -> dict[str, Path]:
-    RAW_DIR.mkdir(parents=True, exist_ok=True)
+def _raw_path(jsonl_name: str) -> Path:
+    # Prefer an already-unzipped file from older runs; otherwise use the
+    # downloaded .gz, which Arrow decompresses on the fly.
+    jsonl_path = RAW_DIR / jsonl_name
+    if jsonl_path.exists():
+        return jsonl_path
+    return RAW_DIR / (jsonl_name + ".gz")
+
+
+def _read_jsonl_table(path: Path):
+    # Arrow's native JSON reader parses JSONL in parallel C++ threads,
+    # far faster than pandas' line-by-line parser, and infers int64 for
+    # the epoch timestamps without any dtype fixup.
+    with pa.input_stream(str(path), compression="detect") as stream:
+        return paj.read_json(
+            stream,
+            read_options=paj.ReadOptions(block_size=64 << 20, use_threads=True),
+        )
+
 
-    unzipped = {}
-    for gz_name, url in URLS.items():
-        gz_path = RAW_DIR / gz_name
-        jsonl_path = gz_path.with_suffix("")  # remove .gz
+def _stream_jsonl_to_parquet(src: Path, dst: Path) -> None:
+    # Feed the ParquetWriter record batches straight off the streaming JSON
+    # reader, so peak memory is one block rather than the whole file and the
+    # write overlaps with the parse.
+    writer = None
+    try:
+        with pa.input_stream(str(src), compression="detect") as stream:
+            reader = paj.open_json(
+                stream,
+                read_options=paj.ReadOptions(block_size=64 << 20, use_threads=True),
+            )
+            for batch in reader:
+                if writer is None:
+                    writer = pq.ParquetWriter(dst, batch.schema, compression="snappy")
+                writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
 
-        # If jsonl already exists, skip download+unzip
-        if jsonl_path.exists():
-            print(f"Raw exists: {jsonl_path}")
-            unzipped[jsonl_path.name] = jsonl_path
-            continue
 
-        # Otherwise download gz if missing, then unzip
-        download_if_missing(url, gz_path)
-        out = gunzip_file(gz_path, keep_gz=True)
-        unzipped[out.name] = out
+def _prepare_one(item: tuple[str, str]) -> tuple[str, Path]:
+    gz_name, url = item
+    gz_path = RAW_DIR / gz_name
+    jsonl_path = gz_path.with_suffix("")  # remove .gz
 
-    return unzipped
+    # An already-unzipped file from an older run works too
+    if jsonl_path.exists():
+        print(f"Raw exists: {jsonl_path}")
+        return jsonl_path.name, jsonl_path
+
+    # Keep the .gz as-is: the readers decompress gzip on the fly, so
+    # unzipping up front only doubles disk usage and adds a full
+    # sequential decompress+write pass.
+    download_if_missing(url, gz_path)
+    return gz_path.name, gz_path
+
+
+def ensure_raw_files() -> dict[str, Path]:
+    RAW_DIR.mkdir(parents=True, exist_ok=True)
+
+    # Download+gunzip the files concurrently: both steps are I/O bound, so
+    # wall time is ~max of the two instead of their sum.
+    with ThreadPoolExecutor(max_workers=len(URLS)) as ex:
+        results = list(ex.map(_prepare_one, URLS.items()))
+
+    return dict(results)
 
 def load_reviews_df(force_reload: bool = False) -> pd.DataFrame:
     ensure_raw_files()
-    path = RAW_DIR / "All_Beauty.jsonl"
-    df = pd.read_json(path, lines=True,  dtype={"timestamp": "int64"})
-    print(df["timestamp"].head())
-    print(df["timestamp"].dtype)
+    path = _raw_path("All_Beauty.jsonl")
+    df = _read_jsonl_table(path).to_pandas()
     return df
 
 def load_meta_df(force_reload: bool = False) -> pd.DataFrame:
     ensure_raw_files()
-    path = RAW_DIR / "meta_All_Beauty.jsonl"
-    df = pd.read_json(path, lines=True)
+    path = _raw_path("meta_All_Beauty.jsonl")
+    df = _read_jsonl_table(path).to_pandas()
     return df
 
 def save_processed_parquet():
     PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
-    
-    reviews = load_reviews_df()
-    meta = load_meta_df()
-
-    print(reviews["timestamp"].head())
-    print(reviews["timestamp"].dtype)
-    
-    # Force timestamp to stay INT64
-    if "timestamp" in reviews.columns:
-        reviews["timestamp"] = reviews["timestamp"].astype("int64")
-
-    # Write Parquet safely
-    reviews.to_parquet(
-        PROCESSED_DIR / "reviews_raw.parquet",
-        index=False,
-        engine="pyarrow"
-    )
-    
-    meta.to_parquet(
-        PROCESSED_DIR / "meta_raw.parquet",
-        index=False,
-        engine="pyarrow"
-    )
-    
-    print("Saved Parquet files cleanly with original timestamp preserved.")
-'''def save_processed_parquet() -> None:'
-    PROCESSED_DIR.mkdir(parents=True, exist_ok=True)
-    reviews = load_reviews_df()
-    meta = load_meta_df()
+    ensure_raw_files()
 
-    reviews.to_parquet(PROCESSED_DIR / "reviews_raw.parquet", index=False, engine="pyarrow", coerce_timestamps="us")
-    meta.to_parquet(PROCESSED_DIR / "meta_raw.parquet", index=False, engine="pyarrow", coerce_timestamps="us")
-    print(f"Saved parquet to: {PROCESSED_DIR}")'''
+    # Stream JSONL -> Parquet chunk by chunk; no pandas round-trip, so the
+    # int64 timestamps are preserved as-is and memory stays bounded.
+    for jsonl_name, out_name in [
+        ("All_Beauty.jsonl", "reviews_raw.parquet"),
+        ("meta_All_Beauty.jsonl", "meta_raw.parquet"),
+    ]:
+        _stream_jsonl_to_parquet(_raw_path(jsonl_name), PROCESSED_DIR / out_name)
+
+    print("Saved Parquet files cleanly with original timestamp preserved.")
 